@@ -1,33 +1,144 @@
-import shutil
+import logging
+import math
+import os
 import subprocess
 from pathlib import Path
+from typing import Optional, Tuple
 
-from .io_utils import ensure_clean_dir
+from .io_utils import ensure_clean_dir, publish_output, size_or_neg
+from .proc_utils import stream_cmd
+
+logger = logging.getLogger(__name__)
 
 
 class ColmapCudaRequiredError(RuntimeError):
     pass
 
 
-def run(cmd):
-    print("\n>>", " ".join(str(x) for x in cmd))
-    p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-
-    if p.returncode != 0:
-        out = p.stdout or ""
-        print(out)
+def run(cmd, log_dir: Optional[Path] = None):
+    """
+    Stream cmd's output; it is also written to <log_dir>/<stage>.log when log_dir is given.
+    """
+    logger.info("\n>> %s", " ".join(str(x) for x in cmd))
+    log_path = (Path(log_dir) / f"{cmd[1]}.log") if log_dir else None
+    returncode, tail = stream_cmd(cmd, log_path=log_path)
 
+    if returncode != 0:
         # Make the failure actionable.
-        if "Dense stereo reconstruction requires CUDA" in out:
+        if "Dense stereo reconstruction requires CUDA" in tail:
             raise ColmapCudaRequiredError(
                 "COLMAP dense reconstruction (patch_match_stereo / stereo_fusion) requires CUDA.\n"
                 "Your current COLMAP build is 'nocuda' and/or your machine has no CUDA GPU.\n"
                 "Use an external dense backend (e.g., OpenMVS) for Stage 2.1 on CPU."
             )
 
-        raise RuntimeError(f"Command failed (code={p.returncode})")
+        raise RuntimeError(f"Command failed (code={returncode}). Last output:\n{tail}")
+
+    return tail
+
+
+def _auto_cache_size_gb(min_gb: int = 4) -> int:
+    """
+    Half of the currently available RAM (at least min_gb), so the OS page cache can
+    absorb depth/normal map re-reads. Needs psutil; without it, min_gb.
+    """
+    try:
+        import psutil
+    except ImportError:
+        return min_gb
+    return max(min_gb, int(psutil.virtual_memory().available * 0.5 / 1e9))
+
+
+def _gpu_free_mb(gpu_index: str = "-1") -> Optional[int]:
+    """
+    Free memory (MiB) of the GPU at gpu_index (the smallest over all GPUs for "-1"),
+    from nvidia-smi. None if it is not available.
+    """
+    cmd = ["nvidia-smi", "--query-gpu=memory.free", "--format=csv,noheader,nounits"]
+    if gpu_index not in ("", "-1"):
+        cmd.append(f"--id={gpu_index}")
+    try:
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+        return min(int(x) for x in p.stdout.split())
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+# Below this the depth maps are too coarse to be worth computing; a smaller fit
+# means the reading is off (e.g. another process holds the GPU) or the GPU is too small.
+PM_MIN_AUTO_IMAGE_SIZE = 400
+# CUDA context, kernels and per-image buffers that do not scale with max_image_size.
+PM_GPU_RESERVE_MB = 1024
 
-    return p.stdout
+
+def auto_pm_max_image_size(
+    image_max_dim: Optional[int], num_src_images: int, max_image_size: int, gpu_index: str = "-1",
+) -> Tuple[int, Optional[int]]:
+    """
+    (size, free_mb): the largest PatchMatch max_image_size (at most max_image_size) whose working set fits
+    in free GPU memory (less PM_GPU_RESERVE_MB): about 12 bytes per pixel for each
+    of num_src_images source views. Also bounded by image_max_dim (the largest input image side, if known),
+    since COLMAP never upsamples, and the free memory it was computed from.
+    size is max_image_size unchanged when free memory cannot be queried (free_mb is
+    then None) or the fit is below PM_MIN_AUTO_IMAGE_SIZE (with a warning).
+
+    Call it while holding the GPU slot, so no other CUDA stage holds memory.
+    """
+    free_mb = _gpu_free_mb(gpu_index.split(",")[0])
+    if free_mb is None:
+        return max_image_size, None
+    usable_mb = max(0, free_mb - PM_GPU_RESERVE_MB)
+    fit = int(math.sqrt(usable_mb * 1024 * 1024 / 12 / max(1, num_src_images)))
+    if fit < min(PM_MIN_AUTO_IMAGE_SIZE, max_image_size):
+        logger.warning(
+            "[WARN] Only %s MiB GPU memory free (fits max_image_size %s); keeping pm_max_image_size %s",
+            free_mb, fit, max_image_size,
+        )
+        return max_image_size, free_mb
+    size = min(max_image_size, fit)
+    if image_max_dim:
+        size = min(size, image_max_dim)
+    return size, free_mb
+
+
+def _has_suffix(d: Path, suffix: str) -> bool:
+    # Stops at the first match; DirEntry names need no extra stat.
+    try:
+        it = os.scandir(d)
+    except FileNotFoundError:
+        return False
+    try:
+        return any(e.name.endswith(suffix) for e in it)
+    finally:
+        it.close()
+
+
+def _is_empty_dir(d: Path) -> bool:
+    try:
+        with os.scandir(d) as it:
+            return next(it, None) is None
+    except FileNotFoundError:
+        return True
+
+
+def _limit_patch_match_sources(cfg_path: Path, num_src_images: int):
+    """
+    Rewrite __all__ / __auto__ source specs in stereo/patch-match.cfg to
+    "__auto__, <num_src_images>" (the most covisible images). The file alternates
+    a reference image name line and its source spec line.
+    """
+    if not cfg_path.exists():
+        return
+    lines = cfg_path.read_text(encoding="utf-8").splitlines()
+    spec = f"__auto__, {num_src_images}"
+    changed = False
+    for i in range(1, len(lines), 2):
+        src = lines[i].strip()
+        if (src == "__all__" or src.startswith("__auto__")) and src != spec:
+            lines[i] = spec
+            changed = True
+    if changed:
+        cfg_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
 
 
 def run_dense_fused_pointcloud(
@@ -37,10 +148,20 @@ def run_dense_fused_pointcloud(
     sparse_model_dir: Path,
     dense_workspace_dir: Path,
     fused_out_ply: Path,
-    max_image_size: int = 1200,
+    undistort_max_image_size: int = 1200,
+    pm_max_image_size: int = 800,
+    fusion_max_image_size: int = 1200,
+    fusion_check_num_images: int = 50,
     geom_consistency: bool = False,
-    patchmatch_cache_size_gb: int = 4,
-    fusion_cache_size_gb: int = 4,
+    patchmatch_cache_size_gb: Optional[int] = None,
+    fusion_cache_size_gb: Optional[int] = None,
+    num_threads: int = -1,
+    pm_window_radius: int = 4,
+    pm_window_step: int = 1,
+    pm_num_iterations: int = 3,
+    pm_num_samples: int = 10,
+    pm_filter_min_ncc: float = 0.08,
+    pm_num_src_images: int = 15,
     clean: bool = False,
     resume: bool = True,
 ):
@@ -51,71 +172,97 @@ def run_dense_fused_pointcloud(
       1) image_undistorter
       2) patch_match_stereo
       3) stereo_fusion
+
+    pm_* trade PatchMatch cost for completeness: NCC cost grows with window_radius^2,
+    and each iteration is a full propagation sweep. pm_num_src_images bounds the
+    source views per reference image.
+
+    PatchMatch cost scales with pixels, so it runs at a smaller pm_max_image_size
+    than undistortion/fusion (fusion rescales between depth maps and images).
+
+    Cache sizes of None are sized from available RAM; num_threads <= 0 means all cores.
     """
     dense_workspace_dir = Path(dense_workspace_dir)
     fused_out_ply = Path(fused_out_ply)
     fused_out_ply.parent.mkdir(parents=True, exist_ok=True)
 
     # Final sentinel (fast skip)
-    if resume and (not clean) and fused_out_ply.exists() and fused_out_ply.stat().st_size > 100_000:
-        print(f"[SKIP] Dense fused point cloud exists: {fused_out_ply}")
+    if resume and (not clean) and size_or_neg(fused_out_ply) > 100_000:
+        logger.info("[SKIP] Dense fused point cloud exists: %s", fused_out_ply)
         return fused_out_ply
 
     if clean:
         ensure_clean_dir(dense_workspace_dir)
     dense_workspace_dir.mkdir(parents=True, exist_ok=True)
+    log_dir = dense_workspace_dir / "logs"
+    if patchmatch_cache_size_gb is None:
+        patchmatch_cache_size_gb = _auto_cache_size_gb()
+    if fusion_cache_size_gb is None:
+        fusion_cache_size_gb = _auto_cache_size_gb()
+    if num_threads <= 0:
+        num_threads = os.cpu_count() or 1
 
     # 1) Undistort (creates COLMAP dense workspace: images/, sparse/, stereo/)
     undist_images_dir = dense_workspace_dir / "images"
-    if (not resume) or clean or (not undist_images_dir.exists()) or (len(list(undist_images_dir.glob("*"))) == 0):
+    if (not resume) or clean or _is_empty_dir(undist_images_dir):
         cmd = [
             colmap_bin, "image_undistorter",
             "--image_path", str(images_dir),
             "--input_path", str(sparse_model_dir),
             "--output_path", str(dense_workspace_dir),
             "--output_type", "COLMAP",
-            "--max_image_size", str(max_image_size),
+            "--max_image_size", str(undistort_max_image_size),
         ]
-        run(cmd)
+        run(cmd, log_dir)
     else:
-        print("[SKIP] image_undistorter (dense workspace already exists)")
+        logger.info("[SKIP] image_undistorter (dense workspace already exists)")
 
     # 2) Patch-match stereo (creates stereo/depth_maps/*.bin etc.)
     depth_maps_dir = dense_workspace_dir / "stereo" / "depth_maps"
-    have_depth = depth_maps_dir.exists() and any(depth_maps_dir.glob("*.bin"))
+    have_depth = _has_suffix(depth_maps_dir, ".bin")
     if (not resume) or clean or (not have_depth):
+        _limit_patch_match_sources(dense_workspace_dir / "stereo" / "patch-match.cfg", pm_num_src_images)
         cmd = [
             colmap_bin, "patch_match_stereo",
             "--workspace_path", str(dense_workspace_dir),
             "--workspace_format", "COLMAP",
-            "--PatchMatchStereo.max_image_size", str(max_image_size),
+            "--PatchMatchStereo.max_image_size", str(pm_max_image_size),
             "--PatchMatchStereo.geom_consistency", "true" if geom_consistency else "false",
             "--PatchMatchStereo.cache_size", str(patchmatch_cache_size_gb),
+            "--PatchMatchStereo.window_radius", str(pm_window_radius),
+            "--PatchMatchStereo.window_step", str(pm_window_step),
+            "--PatchMatchStereo.num_iterations", str(pm_num_iterations),
+            "--PatchMatchStereo.num_samples", str(pm_num_samples),
+            "--PatchMatchStereo.filter_min_ncc", str(pm_filter_min_ncc),
         ]
-        run(cmd)
+        run(cmd, log_dir)
     else:
-        print("[SKIP] patch_match_stereo (depth_maps already exist)")
+        logger.info("[SKIP] patch_match_stereo (depth_maps already exist)")
 
     # 3) Stereo fusion -> fused point cloud
     fused_in_workspace = dense_workspace_dir / "fused.ply"
     input_type = "geometric" if geom_consistency else "photometric"
-    if (not resume) or clean or (not fused_in_workspace.exists()) or fused_in_workspace.stat().st_size < 100_000:
+    if (not resume) or clean or size_or_neg(fused_in_workspace) < 100_000:
         cmd = [
             colmap_bin, "stereo_fusion",
             "--workspace_path", str(dense_workspace_dir),
             "--workspace_format", "COLMAP",
             "--input_type", input_type,
             "--output_path", str(fused_in_workspace),
-            "--StereoFusion.max_image_size", str(max_image_size),
+            "--StereoFusion.max_image_size", str(fusion_max_image_size),
+            "--StereoFusion.check_num_images", str(fusion_check_num_images),
             "--StereoFusion.cache_size", str(fusion_cache_size_gb),
+            "--StereoFusion.num_threads", str(num_threads),
+            "--StereoFusion.min_num_pixels", "5",
+            "--StereoFusion.max_num_pixels", "10000",
         ]
-        run(cmd)
+        run(cmd, log_dir)
     else:
-        print("[SKIP] stereo_fusion (fused.ply already exists in workspace)")
+        logger.info("[SKIP] stereo_fusion (fused.ply already exists in workspace)")
 
     if not fused_in_workspace.exists():
         raise RuntimeError("Dense fusion did not produce fused.ply")
 
-    shutil.copy2(fused_in_workspace, fused_out_ply)
-    print(f"[OK] Dense fused point cloud: {fused_out_ply}")
+    publish_output(fused_in_workspace, fused_out_ply)
+    logger.info("[OK] Dense fused point cloud: %s", fused_out_ply)
     return fused_out_ply
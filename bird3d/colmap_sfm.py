@@ -1,18 +1,268 @@
+import functools
+import json
+import logging
+import os
+import shutil
 import subprocess
+import urllib.request
+from contextlib import nullcontext
 from pathlib import Path
+from typing import Optional
 
-from .io_utils import ensure_clean_dir
+from .io_utils import advise_sequential_read, ensure_clean_dir, list_images
+from .parallel import gpu_slot
+from .proc_utils import stream_cmd
 
+logger = logging.getLogger(__name__)
 
-def run(cmd):
-    print("\n>>", " ".join(str(x) for x in cmd))
-    p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    if p.returncode != 0:
-        print(p.stdout)
-        raise RuntimeError(f"Command failed (code={p.returncode})")
+# Looser global-BA schedule ("COLMAP fast"): fewer global BA runs and Ceres
+# iterations, which is plenty for small arc captures. Each option lists its
+# names newest first (see mapper_fast_preset_args).
+MAPPER_FAST_PRESET = [
+    (("Mapper.ba_global_frames_ratio", "Mapper.ba_global_images_ratio"), "1.32"),
+    (("Mapper.ba_global_points_ratio",), "1.32"),
+    (("Mapper.ba_global_max_num_iterations",), "25"),
+    (("Mapper.ba_global_max_refinements",), "5"),
+    (("Mapper.ba_local_max_num_iterations",), "15"),
+    (("random_seed",), "0"),
+]
+
+def run(cmd, log_dir: Optional[Path] = None):
+    """
+    Stream cmd's output; it is also written to <log_dir>/<stage>.log when log_dir is given.
+    """
+    logger.info("\n>> %s", " ".join(str(x) for x in cmd))
+    log_path = (Path(log_dir) / f"{cmd[1]}.log") if log_dir else None
+    returncode, tail = stream_cmd(cmd, log_path=log_path)
+    if returncode != 0:
+        raise RuntimeError(f"Command failed (code={returncode}). Last output:\n{tail}")
+    return tail
+
+
+FINGERPRINT_NAME = ".pipeline_fingerprint.json"
+
+VOCAB_TREE_URL = "https://github.com/colmap/colmap/releases/download/3.11.1/vocab_tree_flickr100K_words32K.bin"
+
+
+def ensure_vocab_tree(url: str = VOCAB_TREE_URL, timeout: float = 60) -> Path:
+    """
+    Download the COLMAP vocabulary tree once into the user cache and return its path.
+    Call it once before dispatching birds to workers (main() does), not per worker.
+    """
+    cache_dir = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "bird3d"
+    path = cache_dir / url.rsplit("/", 1)[-1]
+    if path.exists():
+        return path
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    logger.info("Downloading vocab tree: %s", url)
+    # Per-process temp name, so concurrent downloads never write the same file
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.part")
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as r, open(tmp, "wb") as f:
+            shutil.copyfileobj(r, f, length=1024 * 1024)
+        tmp.replace(path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def colmap_help(colmap_bin: str, command: str = "help") -> str:
+    """
+    Help text of `colmap <command> -h` (or `colmap help`), cached per binary.
+    Empty if the binary cannot be started.
+    """
+    cmd = [colmap_bin, "help"] if command == "help" else [colmap_bin, command, "-h"]
+    try:
+        p = subprocess.run(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace",
+        )
+    except OSError:
+        return ""
     return p.stdout
 
 
+def feature_option_groups(colmap_bin: str):
+    """
+    Return the (extraction, matching) option prefixes this COLMAP build understands.
+    COLMAP 3.12 renamed --SiftExtraction.* / --SiftMatching.* to
+    --FeatureExtraction.* / --FeatureMatching.*.
+    """
+    out = colmap_help(colmap_bin, "feature_extractor")
+    if "SiftExtraction.use_gpu" in out and "FeatureExtraction.use_gpu" not in out:
+        return "SiftExtraction", "SiftMatching"
+    return "FeatureExtraction", "FeatureMatching"
+
+
+def mapper_fast_preset_args(colmap_bin: str, command: str = "mapper"):
+    """
+    MAPPER_FAST_PRESET as arguments for `colmap <command>`, using the first name of
+    each option this build lists in its help (COLMAP 3.12 renamed
+    --Mapper.ba_global_images_ratio to --Mapper.ba_global_frames_ratio).
+    Options it does not know are left out with a warning.
+    """
+    out = colmap_help(colmap_bin, command)
+    args, missing = [], []
+    for names, value in MAPPER_FAST_PRESET:
+        name = next((n for n in names if f"--{n}" in out), None)
+        if name is None:
+            missing.append(names[0])
+        else:
+            args += [f"--{name}", value]
+    if missing:
+        logger.warning("[WARN] This COLMAP %s has no %s; leaving them at their defaults",
+                       command, ", ".join(f"--{n}" for n in missing))
+    return args
+
+
+def _image_entries(images_dir: Path):
+    entries = []
+    for p in list_images(images_dir):
+        st = p.stat()
+        entries.append([p.name, st.st_size, st.st_mtime_ns])
+    return entries
+
+
+def _write_fingerprint(fp_path: Path, fingerprint: dict, complete: bool):
+    fp_path.write_text(json.dumps({**fingerprint, "complete": complete}, indent=1), encoding="utf-8")
+
+
+def _plan_db_stages(db_path: Path, fp_path: Path, fingerprint: dict):
+    """
+    Decide what to (re)run against database.db by comparing the current image set
+    with the fingerprint of the last extraction/matching. The fingerprint is written
+    with complete=False before those stages and True once matching succeeded, so a
+    database from an interrupted run is finished on the next one.
+
+    Returns (do_extract, new_images, do_match); new_images lists only the names to
+    extract when images were added, or is None for a full extraction.
+    """
+    if not db_path.exists():
+        return True, None, True
+
+    try:
+        previous = json.loads(fp_path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        # Nothing says this DB was ever fully matched: finish it like an interrupted run
+        logger.info("[INFO] database.db has no fingerprint; re-running extraction and matching on it")
+        return True, None, True
+    except ValueError:
+        previous = {}
+
+    old = {name: (size, mtime) for name, size, mtime in previous.get("images", [])}
+    cur = {name: (size, mtime) for name, size, mtime in fingerprint["images"]}
+    same_camera = (
+        previous.get("camera_model") == fingerprint["camera_model"]
+        and previous.get("single_camera") == fingerprint["single_camera"]
+    )
+    changed = any(name in old and old[name] != v for name, v in cur.items())
+    if not same_camera or changed:
+        logger.info("[INFO] Images or camera settings changed since database.db was built; rebuilding it")
+        db_path.unlink()
+        return True, None, True
+
+    if not previous.get("complete", False):
+        # Interrupted run: COLMAP skips images and pairs the database already has
+        logger.info("[INFO] database.db was left incomplete by an earlier run; finishing it")
+        return True, None, True
+
+    added = sorted(name for name in cur if name not in old)
+    if added:
+        return True, added, True
+    return False, None, previous.get("matcher") != fingerprint["matcher"]
+
+
+def _extract_features_pycolmap(
+    *, db_path: Path, images_dir: Path, camera_model: str, single_camera: bool,
+    gpu_index: str, num_threads: int, image_list=None,
+) -> bool:
+    """
+    GPU SIFT extraction in-process through pycolmap (a CUDA build), which avoids
+    SiftGPU's per-image overhead in the feature_extractor binary. Keypoints can
+    differ slightly from SiftGPU's.
+
+    Returns False, without touching the database, when pycolmap is missing, has no
+    CUDA, or its API does not match; the caller then runs feature_extractor.
+    """
+    try:
+        import pycolmap
+    except ImportError:
+        return False
+    if not getattr(pycolmap, "has_cuda", False):
+        return False
+
+    try:
+        sift = pycolmap.SiftExtractionOptions()
+        sift.gpu_index = gpu_index
+        sift.max_num_features = 8192
+        if num_threads > 0:
+            sift.num_threads = num_threads
+        camera_mode = pycolmap.CameraMode.SINGLE if single_camera else pycolmap.CameraMode.AUTO
+        extract = functools.partial(
+            pycolmap.extract_features,
+            database_path=str(db_path),
+            image_path=str(images_dir),
+            image_list=list(image_list or []),
+            camera_mode=camera_mode,
+            camera_model=camera_model,
+            sift_options=sift,
+            device=pycolmap.Device.cuda,
+        )
+    except (AttributeError, TypeError) as e:
+        logger.info("[INFO] pycolmap feature extraction unavailable (%s); using feature_extractor", e)
+        return False
+
+    logger.info("\n>> pycolmap.extract_features (GPU SIFT): %s", images_dir)
+    if image_list:
+        logger.info("[INFO] Extracting features for %s new images only", len(image_list))
+    try:
+        with gpu_slot():
+            extract()
+    except TypeError as e:
+        # Keyword set of this pycolmap version differs (e.g. sift_options renamed);
+        # the bindings validate arguments before doing any work.
+        logger.info("[INFO] pycolmap feature extraction unavailable (%s); using feature_extractor", e)
+        return False
+    return True
+
+
+def _first_model(sparse_dir: Path) -> Path:
+    model0 = sparse_dir / "0"
+    if not model0.exists():
+        subs = sorted([p for p in sparse_dir.iterdir() if p.is_dir()])
+        if not subs:
+            raise RuntimeError("No sparse model produced. Likely insufficient matches/overlap.")
+        model0 = subs[0]
+    return model0
+
+
+# automatic_reconstructor picks the matcher from --data_type
+_AUTO_DATA_TYPE = {"sequential": "video", "exhaustive": "individual", "vocab_tree": "internet"}
+
+
+def _automatic_reconstructor_cmd(
+    *, colmap_bin, images_dir, work_dir, use_gpu, matcher, camera_model, single_camera,
+    num_threads, gpu_index, vocab_tree_path,
+):
+    cmd = [
+        colmap_bin, "automatic_reconstructor",
+        "--workspace_path", str(work_dir),
+        "--image_path", str(images_dir),
+        "--data_type", _AUTO_DATA_TYPE[matcher],
+        "--camera_model", camera_model,
+        "--single_camera", "1" if single_camera else "0",
+        "--dense", "0",
+        "--use_gpu", "1" if use_gpu else "0",
+    ]
+    if use_gpu:
+        cmd += ["--gpu_index", gpu_index]
+    if num_threads > 0:
+        cmd += ["--num_threads", str(num_threads)]
+    if matcher == "vocab_tree":
+        cmd += ["--vocab_tree_path", str(vocab_tree_path or ensure_vocab_tree())]
+    return cmd
+
+
 def run_sfm_sparse(
     *,
     images_dir: Path,
@@ -22,22 +272,89 @@ def run_sfm_sparse(
     matcher: str,
     camera_model: str,
     single_camera: bool,
+    num_threads: int = -1,
+    mapper_fast_preset: bool = False,
+    gpu_index: str = "-1",
+    vocab_tree_path: Optional[Path] = None,
+    single_process: bool = False,
+    ba_use_gpu: bool = False,
+    hierarchical_threshold: Optional[int] = None,
 ) -> Path:
     """
     Runs: feature_extractor -> matcher -> mapper
     Returns: sparse model directory (BIN), e.g. work_dir/sparse/0
+
+    An existing model is returned as is unless images were added or changed since
+    database.db was built (see _plan_db_stages); then features are extracted for
+    the new images and the model is rebuilt.
+
+    single_process: on a fresh database, run all three in one COLMAP process
+    (automatic_reconstructor, writing the same database.db and sparse/ layout) to
+    pay process start-up and CUDA init once. Mapper tuning flags do not apply there.
+
+    ba_use_gpu: run mapper bundle adjustment on gpu_index, if this COLMAP build has
+    --Mapper.ba_use_gpu (otherwise a warning is printed and BA stays on the CPU).
+
+    hierarchical_threshold: use hierarchical_mapper when there are more images than
+    this (0 = always, None = never).
     """
-    model0 = work_dir / "sparse" / "0"
-    if model0.exists():
+    sparse_dir = work_dir / "sparse"
+    model0 = sparse_dir / "0"
+    db_path = work_dir / "database.db"
+    log_dir = work_dir / "logs"
+
+    fp_path = work_dir / FINGERPRINT_NAME
+    # A model without its database or fingerprint (older runs) cannot be checked
+    # against the images; keep it.
+    if model0.exists() and not (db_path.exists() and fp_path.exists()):
         return model0
 
-    sparse_dir = work_dir / "sparse"
+    fingerprint = {
+        "images": _image_entries(images_dir),
+        "camera_model": camera_model,
+        "single_camera": single_camera,
+        "matcher": matcher,
+    }
+    do_extract, new_images, do_match = _plan_db_stages(db_path, fp_path, fingerprint)
+    if model0.exists():
+        if not (do_extract or do_match):
+            return model0
+        logger.info("[INFO] Images or SfM settings changed since %s was built; re-running mapper", model0)
+
     ensure_clean_dir(sparse_dir)
-    db_path = work_dir / "database.db"
-    db_exists = db_path.exists()
+    extraction, matching = feature_option_groups(colmap_bin)
+
+    if single_process and do_extract and new_images is None:
+        if "automatic_reconstructor" in colmap_help(colmap_bin):
+            cmd = _automatic_reconstructor_cmd(
+                colmap_bin=colmap_bin, images_dir=images_dir, work_dir=work_dir,
+                use_gpu=use_gpu, matcher=matcher, camera_model=camera_model,
+                single_camera=single_camera, num_threads=num_threads,
+                gpu_index=gpu_index, vocab_tree_path=vocab_tree_path,
+            )
+            _write_fingerprint(fp_path, fingerprint, complete=False)
+            with gpu_slot() if use_gpu else nullcontext():
+                run(cmd, log_dir)
+            _write_fingerprint(fp_path, fingerprint, complete=True)
+            return _first_model(sparse_dir)
+        logger.info("[INFO] automatic_reconstructor not available; running SfM stages separately")
+
+    if do_extract or do_match:
+        _write_fingerprint(fp_path, fingerprint, complete=False)
 
-    # Feature extraction (skip if DB already exists)
-    if not db_exists:
+    # Feature extraction (all images, only the newly added ones, or skipped)
+    if do_extract:
+        # Page images in ahead of the extractor
+        names = new_images or [name for name, _, _ in fingerprint["images"]]
+        advise_sequential_read(images_dir / n for n in names)
+    extracted = False
+    if do_extract and use_gpu:
+        extracted = _extract_features_pycolmap(
+            db_path=db_path, images_dir=images_dir, camera_model=camera_model,
+            single_camera=single_camera, gpu_index=gpu_index,
+            num_threads=num_threads, image_list=new_images,
+        )
+    if do_extract and not extracted:
         cmd = [
             colmap_bin, "feature_extractor",
             "--database_path", str(db_path),
@@ -45,40 +362,78 @@ def run_sfm_sparse(
             "--ImageReader.camera_model", camera_model,
             "--ImageReader.single_camera", "1" if single_camera else "0",
         ]
-        if not use_gpu:
-            cmd += ["--FeatureExtraction.use_gpu", "0"]
-        run(cmd)
-    else:
-        print(f"[SKIP] feature_extractor (database exists): {db_path}")
+        if new_images:
+            image_list = work_dir / "new_images.txt"
+            image_list.write_text("\n".join(new_images) + "\n", encoding="utf-8")
+            cmd += ["--image_list_path", str(image_list)]
+            logger.info("[INFO] Extracting features for %s new images only", len(new_images))
+        if use_gpu:
+            cmd += [f"--{extraction}.use_gpu", "1", f"--{extraction}.gpu_index", gpu_index]
+        else:
+            cmd += [f"--{extraction}.use_gpu", "0"]
+        if num_threads > 0:
+            cmd += [f"--{extraction}.num_threads", str(num_threads)]
+        with gpu_slot() if use_gpu else nullcontext():
+            run(cmd, log_dir)
+    elif not do_extract:
+        logger.info("[SKIP] feature_extractor (database up to date): %s", db_path)
 
-    # Matching (skip if DB already exists)
-    if not db_exists:
+    # Matching (COLMAP skips image pairs that are already matched in the DB)
+    if do_match:
         if matcher == "sequential":
             cmd = [colmap_bin, "sequential_matcher", "--database_path", str(db_path)]
         elif matcher == "exhaustive":
             cmd = [colmap_bin, "exhaustive_matcher", "--database_path", str(db_path)]
+        elif matcher == "vocab_tree":
+            cmd = [
+                colmap_bin, "vocab_tree_matcher",
+                "--database_path", str(db_path),
+                "--VocabTreeMatching.vocab_tree_path", str(vocab_tree_path or ensure_vocab_tree()),
+                "--VocabTreeMatching.num_images", "100",
+                "--VocabTreeMatching.num_nearest_neighbors", "5",
+            ]
         else:
-            raise ValueError("matcher must be 'sequential' or 'exhaustive'")
+            raise ValueError("matcher must be 'sequential', 'exhaustive' or 'vocab_tree'")
 
-        if not use_gpu:
-            cmd += ["--FeatureMatching.use_gpu", "0"]
-        run(cmd)
+        if use_gpu:
+            cmd += [f"--{matching}.use_gpu", "1", f"--{matching}.gpu_index", gpu_index]
+        else:
+            cmd += [f"--{matching}.use_gpu", "0"]
+        if num_threads > 0:
+            cmd += [f"--{matching}.num_threads", str(num_threads)]
+        with gpu_slot() if use_gpu else nullcontext():
+            run(cmd, log_dir)
     else:
-        print(f"[SKIP] matcher (database exists): {db_path}")
+        logger.info("[SKIP] matcher (database up to date): %s", db_path)
+
+    if do_extract or do_match:
+        _write_fingerprint(fp_path, fingerprint, complete=True)
 
     # Mapping
-    run([
-        colmap_bin, "mapper",
+    n_images = len(fingerprint["images"])
+    hierarchical = hierarchical_threshold is not None and n_images > hierarchical_threshold
+    cmd = [
+        colmap_bin, "hierarchical_mapper" if hierarchical else "mapper",
         "--database_path", str(db_path),
         "--image_path", str(images_dir),
         "--output_path", str(sparse_dir),
-    ])
-
-    model0 = sparse_dir / "0"
-    if not model0.exists():
-        subs = sorted([p for p in sparse_dir.iterdir() if p.is_dir()])
-        if not subs:
-            raise RuntimeError("No sparse model produced. Likely insufficient matches/overlap.")
-        model0 = subs[0]
+    ]
+    if hierarchical:
+        # Clusters are reconstructed in parallel and then merged. The merge needs
+        # enough overlap between clusters; weakly connected captures can come out
+        # as several sub-models (see sparse/1, ...) instead of one.
+        logger.info("[INFO] %s images: using hierarchical_mapper", n_images)
+        cmd += ["--num_workers", str(num_threads)]
+    if num_threads > 0:
+        cmd += ["--Mapper.num_threads", str(num_threads)]
+    if mapper_fast_preset:
+        cmd += mapper_fast_preset_args(colmap_bin, cmd[1])
+    if ba_use_gpu and "Mapper.ba_use_gpu" not in colmap_help(colmap_bin, "mapper"):
+        logger.warning("[WARN] This COLMAP has no --Mapper.ba_use_gpu; bundle adjustment stays on the CPU")
+        ba_use_gpu = False
+    if ba_use_gpu:
+        cmd += ["--Mapper.ba_use_gpu", "1", "--Mapper.ba_gpu_index", gpu_index]
+    with gpu_slot() if ba_use_gpu else nullcontext():
+        run(cmd, log_dir)
 
-    return model0
+    return _first_model(sparse_dir)
@@ -1,18 +1,41 @@
 from dataclasses import dataclass
+from typing import Optional
 
 
 @dataclass
 class Config:
     colmap_bin: str = r"..\TOOLS\colmap-x64-windows-nocuda\bin\colmap.exe" 
     use_gpu: bool = False
-    matcher: str = "sequential"         # sequential fits arc captures
+    colmap_bin_cuda: Optional[str] = None  # CUDA-enabled COLMAP; enables GPU SIFT + dense
+    gpu_indices: str = "0"              # e.g. "0,1" to fan SIFT out across GPUs
+    matcher: str = "sequential"         # sequential fits arc captures; "exhaustive" or "vocab_tree"
+    vocab_tree_path: Optional[str] = None  # vocab_tree matcher; downloaded to user cache if unset
     camera_model: str = "SIMPLE_RADIAL" # good for phone
     single_camera: bool = True
+    num_threads: int = -1               # per COLMAP process; -1 = all cores
+    num_gpus: int = 1                   # concurrent CUDA stages across workers
+    mapper_fast_preset: bool = True     # looser global BA schedule for mapper
+    sfm_single_process: bool = False    # SfM via one automatic_reconstructor process
+    ba_use_gpu: bool = False            # mapper BA on GPU (needs Ceres with CUDA)
+    hierarchical_threshold: Optional[int] = 200  # hierarchical_mapper above this many images; None = never
+    link_mode: str = "hardlink"         # images_clean staging: "hardlink", "reflink" or "copy"
+    stage_mode: str = "symlink"         # images_clean: "symlink", "copy" (see link_mode) or "inplace"
 
-    dense_max_image_size: int = 1200
+    undistort_max_image_size: int = 1200
+    pm_max_image_size: int = 800        # PatchMatch cost ~ pixels; 800 is plenty for bird-scale meshes
+    pm_max_image_size_auto: bool = True # lower pm_max_image_size per bird to fit free GPU memory
+    fusion_max_image_size: int = 1200
+    fusion_check_num_images: int = 50
     dense_geom_consistency: bool = False
-    dense_patchmatch_cache_size_gb: int = 4
-    dense_fusion_cache_size_gb: int = 4
-    dense_backend: str = "openmvs"  # "colmap" or "openmvs"
+    dense_patchmatch_cache_size_gb: Optional[int] = None  # None = half of available RAM (min 4)
+    dense_fusion_cache_size_gb: Optional[int] = None
+    # PatchMatchStereo cost knobs (COLMAP defaults: 5 / 1 / 5 / 15 / 0.1)
+    pm_window_radius: int = 4
+    pm_window_step: int = 1
+    pm_num_iterations: int = 3
+    pm_num_samples: int = 10
+    pm_filter_min_ncc: float = 0.08
+    pm_num_src_images: int = 15         # source views per reference image (patch-match.cfg)
+    dense_backend: str = "openmvs"  # "colmap", "openmvs" or "cusfm"
     openmvs_bin: str = r"..\TOOLS\openMVS\bin"
     openmvs_resolution_level: int = 2
\ No newline at end of file
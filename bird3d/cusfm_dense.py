@@ -0,0 +1,74 @@
+import logging
+import shutil
+from pathlib import Path
+
+from .io_utils import publish_output, size_or_neg
+
+logger = logging.getLogger(__name__)
+
+
+class CusfmUnavailableError(RuntimeError):
+    pass
+
+
+def run_cusfm_dense(
+    *,
+    sparse_model_dir: Path,
+    images_dir: Path,
+    work_dir: Path,
+    fused_out_ply: Path,
+    max_image_size: int = 800,
+    clean: bool = False,
+    resume: bool = True,
+):
+    """
+    Stage 2 (GPU): dense point cloud from a COLMAP sparse model with pyCuSFM.
+
+    pycusfm is optional and imported lazily; CusfmUnavailableError is raised when it
+    is missing or does not accept the expected Pipeline API (construction or
+    run()), so the caller can fall back to COLMAP.
+    """
+    sparse_model_dir = Path(sparse_model_dir)
+    images_dir = Path(images_dir)
+    work_dir = Path(work_dir)
+    fused_out_ply = Path(fused_out_ply)
+    fused_out_ply.parent.mkdir(parents=True, exist_ok=True)
+
+    if resume and (not clean) and size_or_neg(fused_out_ply) > 100_000:
+        logger.info("[SKIP] cuSfM dense point cloud exists: %s", fused_out_ply)
+        return fused_out_ply
+
+    try:
+        import pycusfm
+    except ImportError as e:
+        raise CusfmUnavailableError(f"pycusfm is not installed ({e})") from e
+
+    if clean and work_dir.exists():
+        shutil.rmtree(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    try:
+        config = pycusfm.PipelineConfig()
+        config.mvs.max_image_size = int(max_image_size)
+        pipeline = pycusfm.Pipeline(config)
+    except AttributeError as e:
+        raise CusfmUnavailableError(f"unsupported pycusfm version ({e})") from e
+
+    out_ply = work_dir / "fused.ply"
+    try:
+        pipeline.run(
+            sparse_model=str(sparse_model_dir),
+            image_dir=str(images_dir),
+            output_dir=str(work_dir),
+            output_ply=str(out_ply),
+        )
+    except (AttributeError, TypeError) as e:
+        # Argument/attribute mismatch with this pycusfm version, not a failed run
+        raise CusfmUnavailableError(f"unsupported pycusfm version ({e})") from e
+
+    if not out_ply.exists():
+        raise RuntimeError(f"cuSfM did not produce {out_ply}.")
+
+    publish_output(out_ply, fused_out_ply)
+    logger.info("[OK] cuSfM dense point cloud: %s", fused_out_ply)
+    return fused_out_ply
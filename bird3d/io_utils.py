@@ -1,22 +1,354 @@
+import json
+import logging
+import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    from PIL import Image
+except ImportError:  # optional: image_metadata only
+    Image = None
+
+logger = logging.getLogger(__name__)
+
 IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".JPG", ".JPEG", ".PNG"}
+_IMAGE_EXTS_NO_DOT = {e[1:] for e in IMAGE_EXTS}
+_COPY_CHUNK = 16 * 1024 * 1024
+_FICLONE = 0x40049409  # linux/fs.h
+LINK_MODES = ("hardlink", "reflink", "copy")
 
 def list_bird_folders(data_dir: Path):
     return [p for p in sorted(data_dir.iterdir())
             if p.is_dir() and not p.name.startswith(".")]
 
+def _image_names(images_dir, exts):
+    # One scandir pass; DirEntry.is_file() uses the cached dirent type (follows symlinks).
+    names = []
+    with os.scandir(images_dir) as it:
+        for e in it:
+            _, dot, ext = e.name.rpartition(".")
+            if dot and ext in exts and e.is_file():
+                names.append(e.name)
+    return names
+
 def list_images(images_dir: Path):
-    return [p for p in sorted(images_dir.iterdir())
-            if p.is_file() and p.suffix in IMAGE_EXTS]
+    return [images_dir / n for n in sorted(_image_names(images_dir, _IMAGE_EXTS_NO_DOT))]
+
+def load_or_build_manifest(data_dir: Path, cache_path: Path) -> dict:
+    """
+    {bird folder name: [image file names]} for data_dir, as list_bird_folders and
+    list_images would return them.
+
+    Cached as JSON in cache_path together with each directory's mtime; adding,
+    removing or renaming a file changes its directory's mtime, so only folders
+    whose mtime changed are rescanned (a single stat each otherwise).
+    """
+    data_dir = Path(data_dir)
+    cache_path = Path(cache_path)
+    try:
+        cached = json.loads(cache_path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        cached = {}
+    if cached.get("data_dir") != str(data_dir):
+        cached = {}
+    old = cached.get("birds", {})
+
+    data_mtime = os.stat(data_dir).st_mtime_ns
+    if cached.get("mtime_ns") == data_mtime:
+        names = list(old)
+    else:
+        names = [p.name for p in list_bird_folders(data_dir)]
+
+    birds = {}
+    for name in names:
+        mtime = os.stat(data_dir / name).st_mtime_ns
+        entry = old.get(name)
+        if entry is None or entry["mtime_ns"] != mtime:
+            entry = {"mtime_ns": mtime, "images": sorted(_image_names(data_dir / name, _IMAGE_EXTS_NO_DOT))}
+        birds[name] = entry
+
+    manifest = {"data_dir": str(data_dir), "mtime_ns": data_mtime, "birds": birds}
+    if manifest != cached:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_path.with_name(cache_path.name + ".tmp")
+        tmp.write_text(json.dumps(manifest), encoding="utf-8")
+        tmp.replace(cache_path)
+    return {name: entry["images"] for name, entry in birds.items()}
+
+def _read_image_meta(p: Path):
+    st = os.stat(p)
+    try:
+        im = Image.open(p)  # parses the header only
+    except OSError:
+        return None  # not a readable image; left out of the cache
+    with im:
+        return {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "width": im.width,
+            "height": im.height,
+            "channels": len(im.getbands()),
+        }
+
+
+def image_metadata(image_paths, cache_path: Path, max_workers: int = 8) -> dict:
+    """
+    {image name: {"size", "mtime_ns", "width", "height", "channels"}} for
+    image_paths, cached as JSON in cache_path. Only images whose (size, mtime_ns)
+    changed are re-read. Needs Pillow; returns {} without it.
+    """
+    if Image is None:
+        return {}
+    cache_path = Path(cache_path)
+    try:
+        cached = json.loads(cache_path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        cached = {}
+
+    meta = {}
+    todo = []
+    for p in image_paths:
+        entry = cached.get(p.name)
+        st = os.stat(p)
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            meta[p.name] = entry
+        else:
+            todo.append(p)
+    if todo:
+        # Header parsing is mostly file I/O, so a few threads overlap it.
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            for p, entry in zip(todo, ex.map(_read_image_meta, todo)):
+                if entry is not None:
+                    meta[p.name] = entry
+
+    if meta != cached:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_path.with_name(cache_path.name + ".tmp")
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
+        tmp.replace(cache_path)
+    return meta
+
+def size_or_neg(path: Path) -> int:
+    """
+    File size in bytes, or -1 if it does not exist (one stat instead of exists() + stat()).
+    """
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return -1
+
+def advise_sequential_read(paths):
+    """
+    Tell the kernel each file will be read sequentially and start reading it ahead
+    now (posix_fadvise SEQUENTIAL + WILLNEED). No-op where posix_fadvise is missing.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for p in paths:
+        try:
+            fd = os.open(p, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
 
 def ensure_clean_dir(path: Path):
     if path.exists():
         shutil.rmtree(path)
     path.mkdir(parents=True, exist_ok=True)
 
-def copy_images(image_paths, dst_dir: Path):
+def _reflink(src: Path, dst: Path) -> bool:
+    """
+    Copy-on-write clone via ioctl(FICLONE) (Btrfs/XFS, same filesystem). Linux only.
+    """
+    if fcntl is None:
+        return False
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        return False
+
+
+def _copy_file_range(src: Path, dst: Path) -> bool:
+    """
+    In-kernel copy (reflinks on XFS/Btrfs). Returns False if unsupported here.
+    """
+    if not hasattr(os, "copy_file_range"):
+        return False
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(remaining, _COPY_CHUNK))
+                if n == 0:
+                    break
+                remaining -= n
+        return remaining == 0
+    except OSError:
+        return False
+
+
+def _sendfile(src: Path, dst: Path) -> bool:
+    """
+    Zero-copy file-to-file transfer with os.sendfile (bytes stay in the kernel).
+    """
+    if not hasattr(os, "sendfile"):
+        return False
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            offset = 0
+            while offset < size:
+                n = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, min(size - offset, _COPY_CHUNK))
+                if n == 0:
+                    break
+                offset += n
+        return offset == size
+    except OSError:
+        return False
+
+
+def fast_publish(src: Path, dst: Path, mode: str = "hardlink"):
+    """
+    Make dst a copy of src as cheaply as possible. mode picks the first strategy:
+      "hardlink": os.link (same filesystem, no data copied), then as "reflink"
+      "reflink":  FICLONE copy-on-write clone, then as "copy"
+      "copy":     os.copy_file_range, os.sendfile, then a plain buffered copy
+    Metadata is preserved like shutil.copy2. Hardlinks are only for files that are
+    not rewritten in place afterwards.
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f"mode must be one of {LINK_MODES}")
+    src = Path(src)
+    dst = Path(dst)
+    if dst.is_symlink():
+        dst.unlink()
+    elif dst.exists():
+        if mode == "hardlink" and os.path.samefile(src, dst):
+            return dst
+        # Also breaks a hardlink left by an earlier run, so dst gets its own data.
+        dst.unlink()
+
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return dst
+        except OSError:
+            pass
+
+    if mode in ("hardlink", "reflink") and _reflink(src, dst):
+        pass
+    elif not (_copy_file_range(src, dst) or _sendfile(src, dst)):
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            shutil.copyfileobj(fsrc, fdst, length=_COPY_CHUNK)
+    shutil.copystat(src, dst)
+    return dst
+
+
+def publish_output(src: Path, dst: Path):
+    """
+    Publish a result file from a work dir (e.g. a dense fused.ply) to dst.
+    Never a hardlink: the work copy is rewritten in place when its stage reruns,
+    which would silently change the published file too.
+    """
+    return fast_publish(src, dst, mode="reflink")
+
+
+def _symlink(src: Path, dst: Path) -> bool:
+    if dst.is_symlink() or dst.exists():
+        dst.unlink()
+    try:
+        os.symlink(Path(src).resolve(), dst)
+        return True
+    except OSError:
+        # e.g. Windows without symlink privilege
+        return False
+
+
+def copy_images(image_paths, dst_dir: Path, link_mode: str = "hardlink", max_workers: int = 8):
+    """
+    Stage images into dst_dir. COLMAP only reads them, so by default hardlink where
+    possible (see fast_publish for link_mode), else copy.
+
+    Files are staged by a small thread pool so per-file open/copy syscalls overlap
+    (the copies run in the kernel with the GIL released).
+    """
+    image_paths = list(image_paths)
     dst_dir.mkdir(parents=True, exist_ok=True)
+
+    def stage(p):
+        fast_publish(p, dst_dir / p.name, mode=link_mode)
+
+    if max_workers <= 1 or len(image_paths) <= 1:
+        for p in image_paths:
+            stage(p)
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        # list() re-raises the first failure
+        list(ex.map(stage, image_paths))
+
+
+def symlink_images(image_paths, dst_dir: Path, link_mode: str = "hardlink"):
+    """
+    Stage images into dst_dir as symlinks to the originals (COLMAP follows them).
+    Images that cannot be symlinked (e.g. Windows without the privilege) are
+    staged with copy_images instead.
+    """
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    failed = [p for p in image_paths if not _symlink(p, dst_dir / p.name)]
+    if failed:
+        logger.info("[INFO] Could not symlink %s images; staging them with %s", len(failed), link_mode)
+        copy_images(failed, dst_dir, link_mode=link_mode)
+
+
+def can_use_inplace(images_dir: Path, image_paths) -> bool:
+    """
+    True if images_dir holds exactly image_paths and nothing else, so COLMAP can
+    read it directly (it would otherwise also pick up other files and subfolders).
+    """
+    images_dir = Path(images_dir)
+    if any(Path(p).parent != images_dir for p in image_paths):
+        return False
+    return not has_more_than_n_entries(images_dir, len(image_paths))
+
+
+def has_more_than_n_entries(d: Path, n: int) -> bool:
+    """
+    True if directory d has more than n entries; stops scanning at entry n + 1.
+    """
+    with os.scandir(d) as it:
+        for i, _ in enumerate(it):
+            if i >= n:
+                return True
+    return False
+
+
+def staged_images_match(dst_dir: Path, image_paths) -> bool:
+    """
+    True if dst_dir holds exactly the images in image_paths (by name), and every
+    symlink among them still points at its source image.
+    """
+    try:
+        staged = set(_image_names(dst_dir, _IMAGE_EXTS_NO_DOT))
+    except FileNotFoundError:
+        return False
+    if staged != {p.name for p in image_paths}:
+        return False
     for p in image_paths:
-        shutil.copy2(p, dst_dir / p.name)
+        dst = dst_dir / p.name
+        if dst.is_symlink() and Path(os.readlink(dst)) != Path(p).resolve():
+            return False
+    return True
@@ -1,13 +1,45 @@
+import functools
+import logging
+import mmap
+import os
+import struct
 import subprocess
 from pathlib import Path
 import re
 
 
-_IMG_RE = re.compile(r".*\.(jpg|jpeg|png|tif|tiff|bmp|webp)$", re.IGNORECASE)
+logger = logging.getLogger(__name__)
+
+_IMG_SUFFIXES = (b".jpg", b".jpeg", b".png", b".tif", b".tiff", b".bmp", b".webp")
+_MAX_SUFFIX_LEN = max(len(x) for x in _IMG_SUFFIXES)
+# COLMAP writes "# Number of images: <num registered>, mean observations per image: ..."
+_NUM_IMAGES_RE = re.compile(rb"^#\s*Number of images\s*:\s*(\d+)")
+
+
+def _read_reconstruction(model_dir: Path):
+    """
+    pycolmap.Reconstruction of model_dir (BIN or TXT), or None when pycolmap is not
+    installed or cannot read it; callers then fall back to the colmap binary.
+    """
+    try:
+        import pycolmap
+    except ImportError:
+        return None
+    try:
+        return pycolmap.Reconstruction(str(model_dir))
+    except (AttributeError, RuntimeError, ValueError) as e:
+        logger.info("[INFO] pycolmap could not read %s (%s); using colmap", model_dir, e)
+        return None
 
 
 def export_model_to_txt(colmap_bin: str, sparse_bin_dir: Path, out_txt_dir: Path):
     out_txt_dir.mkdir(parents=True, exist_ok=True)
+    # In-process when pycolmap is available (no model_converter start-up per bird)
+    rec = _read_reconstruction(sparse_bin_dir)
+    if rec is not None:
+        rec.write_text(str(out_txt_dir))
+        return
+
     cmd = [
         colmap_bin, "model_converter",
         "--input_path", str(sparse_bin_dir),
@@ -16,10 +48,30 @@ def export_model_to_txt(colmap_bin: str, sparse_bin_dir: Path, out_txt_dir: Path
     ]
     p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
     if p.returncode != 0:
-        print(p.stdout)
+        logger.error("%s", p.stdout)
         raise RuntimeError("model_converter failed")
 
 
+def _read_bin_count(path: Path) -> int:
+    # COLMAP BIN model files start with a little-endian uint64 record count.
+    with open(path, "rb") as f:
+        return struct.unpack("<Q", f.read(8))[0]
+
+
+def count_images_bin(model_dir: Path) -> int:
+    """
+    Registered images in a BIN model, read from the images.bin header.
+    """
+    return _read_bin_count(Path(model_dir) / "images.bin")
+
+
+def count_points3d_bin(model_dir: Path) -> int:
+    """
+    3D points in a BIN model, read from the points3D.bin header.
+    """
+    return _read_bin_count(Path(model_dir) / "points3D.bin")
+
+
 def registered_images_model_analyzer(colmap_bin: str, model_dir: Path) -> int:
     """
     Use COLMAP's model_analyzer to count registered images.
@@ -31,29 +83,65 @@ def registered_images_model_analyzer(colmap_bin: str, model_dir: Path) -> int:
     ]
     p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
     if p.returncode != 0:
-        print(p.stdout)
+        logger.error("%s", p.stdout)
         raise RuntimeError("model_analyzer failed")
 
     # Typical line contains: "Registered images: <N>"
     m = re.search(r"Registered images\s*:\s*(\d+)", p.stdout)
     if not m:
         # If COLMAP output format changes, this will show you what to match.
-        print(p.stdout)
+        logger.error("%s", p.stdout)
         raise RuntimeError("Could not parse registered images from model_analyzer output")
 
     return int(m.group(1))
 
 
+@functools.lru_cache(maxsize=256)
+def _registered_images_cached(colmap_bin: str, model_dir_str: str, mtime_ns: int, size: int) -> int:
+    # mtime_ns/size are only part of the cache key.
+    rec = _read_reconstruction(Path(model_dir_str))
+    if rec is not None:
+        return rec.num_reg_images()
+    return registered_images_model_analyzer(colmap_bin, Path(model_dir_str))
+
+
+def _model_fingerprint(model_dir: Path):
+    """
+    (mtime_ns, size) of the model's images file, or None if there is none.
+    COLMAP rewrites the whole file whenever the model changes.
+    """
+    for name in ("images.bin", "images.txt"):
+        try:
+            st = os.stat(model_dir / name)
+        except FileNotFoundError:
+            continue
+        return st.st_mtime_ns, st.st_size
+    return None
+
+
 def registered_images_best_effort(
     colmap_bin: str,
     model_dir: Path,
     images_txt_fallback: Path = None,
 ) -> int:
     """
-    Prefer COLMAP model_analyzer; fall back to parsing images.txt.
+    Prefer the images.bin (or images.txt) header, then pycolmap / COLMAP model_analyzer;
+    fall back to parsing images_txt_fallback.
     """
     try:
-        return registered_images_model_analyzer(colmap_bin, model_dir)
+        return count_images_bin(model_dir)
+    except (OSError, struct.error):
+        pass
+
+    images_txt = Path(model_dir) / "images.txt"
+    if images_txt.exists():
+        return count_registered_images(images_txt)
+
+    try:
+        fp = _model_fingerprint(Path(model_dir))
+        if fp is None:
+            return registered_images_model_analyzer(colmap_bin, model_dir)
+        return _registered_images_cached(colmap_bin, str(model_dir), *fp)
     except Exception:
         if images_txt_fallback is not None:
             return count_registered_images(images_txt_fallback)
@@ -68,17 +156,29 @@ def count_registered_images(images_txt: Path) -> int:
       - header line ends with the image filename
       - next line contains 2D points (numbers), no filename
     So we count only lines where the last token is an image filename.
+
+    The '#' header written by COLMAP already states the count, so normally only
+    the first few lines are read; the full scan is the fallback.
     """
-    if not images_txt.exists():
+    if not images_txt.exists() or images_txt.stat().st_size == 0:
         return 0
-    
+
+    # POINTS2D lines end in a number, so the C-level endswith rejects them without
+    # tokenizing; only filename-terminated lines are split to confirm the header shape.
     n = 0
-    with images_txt.open("r", errors="ignore") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"):
+    with images_txt.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for line in iter(mm.readline, b""):
+            if not line.startswith(b"#"):
+                break
+            m = _NUM_IMAGES_RE.match(line)
+            if m:
+                return int(m.group(1))
+
+        mm.seek(0)
+        for line in iter(mm.readline, b""):
+            if line.startswith(b"#"):
                 continue
-            parts = line.split()
-            if len(parts) >= 10 and _IMG_RE.match(parts[-1]):
+            line = line.rstrip()
+            if line[-_MAX_SUFFIX_LEN:].lower().endswith(_IMG_SUFFIXES) and len(line.split()) >= 10:
                 n += 1
     return n
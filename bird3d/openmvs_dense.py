@@ -1,9 +1,15 @@
+import functools
+import logging
 import os
 import shutil
-import subprocess
 from pathlib import Path
 from typing import Optional
 
+from .io_utils import fast_publish, publish_output, size_or_neg
+from .proc_utils import stream_cmd
+
+logger = logging.getLogger(__name__)
+
 
 def _prepare_colmap_input_for_openmvs(colmap_root: Path, work_dir: Path) -> Path:
     """
@@ -14,7 +20,7 @@ def _prepare_colmap_input_for_openmvs(colmap_root: Path, work_dir: Path) -> Path
 
     We create a small shim workspace:
         <work_dir>/_colmap_ws/sparse/{cameras.bin,images.bin,points3D.bin}
-    by copying from <colmap_root>/sparse/0/* when needed.
+    by hardlinking (or copying) from <colmap_root>/sparse/0/* when needed.
     """
     colmap_root = Path(colmap_root)
     work_dir = Path(work_dir)
@@ -48,43 +54,93 @@ def _prepare_colmap_input_for_openmvs(colmap_root: Path, work_dir: Path) -> Path
     shim_sparse = shim / "sparse"
     shim_sparse.mkdir(parents=True, exist_ok=True)
 
+    # Model files are immutable once COLMAP wrote them: hardlink (copy across devices).
+    # fast_publish keeps a link that is still current and replaces one to a model
+    # that has since been rebuilt.
     for f in src_files:
-        shutil.copy2(sparse0 / f, shim_sparse / f)
+        fast_publish(sparse0 / f, shim_sparse / f)
 
     return shim
 
 
 def _run(cmd, cwd: Optional[Path] = None):
-    print("\n>>", " ".join(str(x) for x in cmd))
-    p = subprocess.run(
-        cmd,
-        cwd=str(cwd) if cwd else None,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-    )
-    if p.returncode != 0:
-        print(p.stdout)
-        raise RuntimeError(f"Command failed (code={p.returncode})")
-    return p.stdout
-
-
-def _resolve_exe(openmvs_bin: Path, name: str) -> Path:
+    logger.info("\n>> %s", " ".join(str(x) for x in cmd))
+    log_path = (Path(cwd) / "logs" / f"{Path(cmd[0]).stem}.log") if cwd else None
+    returncode, tail = stream_cmd(cmd, cwd=cwd, log_path=log_path)
+    if returncode != 0:
+        raise RuntimeError(f"Command failed (code={returncode}). Last output:\n{tail}")
+    return tail
+
+
+def _is_ply(path: Path) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(4) == b"ply\n"
+    except OSError:
+        return False
+
+
+def _densify_in_process(
+    scene_mvs: Path, scene_dense_mvs: Path, scene_dense_ply: Path, resolution_level: int,
+) -> bool:
+    """
+    DensifyPointCloud through the OpenMVS Python bindings (module "MVS"), on the
+    scene.mvs written by InterfaceCOLMAP, without starting another process.
+
+    Returns False on any failure (bindings missing, different API, failed
+    reconstruction, or no PLY written); the caller then runs DensifyPointCloud.
     """
-    Resolve OpenMVS executable path (Windows-friendly).
+    try:
+        import MVS
+    except ImportError:
+        return False
+
+    logger.info("\n>> MVS.Scene (in-process densify): %s", scene_mvs)
+    try:
+        scene = MVS.Scene()
+        if not scene.Load(str(scene_mvs)):
+            raise RuntimeError(f"could not load {scene_mvs}")
+        options = MVS.DenseOptions()
+        options.resolution_level = int(resolution_level)
+        if not scene.DenseReconstruction(options):
+            raise RuntimeError("dense reconstruction failed")
+        # The point cloud goes to the .ply; the scene archive to scene_dense.mvs.
+        if not scene.pointcloud.Save(str(scene_dense_ply)):
+            raise RuntimeError(f"could not write {scene_dense_ply}")
+        scene.Save(str(scene_dense_mvs))
+    except Exception as e:  # the bindings are optional; any failure falls back
+        logger.info("[INFO] OpenMVS in-process densify unavailable (%s); using DensifyPointCloud", e)
+        return False
+
+    if not _is_ply(scene_dense_ply):
+        logger.info("[INFO] OpenMVS bindings did not write a PLY point cloud; using DensifyPointCloud")
+        scene_dense_ply.unlink(missing_ok=True)
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=32)
+def _resolve_exe(openmvs_bin: str, name: str) -> Path:
     """
-    openmvs_bin = Path(openmvs_bin)
+    Resolve OpenMVS executable path (Windows-friendly). Cached per (bin dir, name).
+    """
+    # shutil.which also tries PATHEXT (.exe) on Windows
+    found = shutil.which(name, path=openmvs_bin) or shutil.which(name)
+    if found:
+        return Path(found)
+
+    bin_dir = Path(openmvs_bin)
     candidates = [
-        openmvs_bin / name,
-        openmvs_bin / f"{name}.exe",
-        Path(name),              # in PATH
-        Path(f"{name}.exe"),     # in PATH on Windows
+        bin_dir / name,
+        bin_dir / f"{name}.exe",
+        Path(name),              # relative to cwd
+        Path(f"{name}.exe"),
     ]
     for c in candidates:
         if c.exists():
             return c
     # last resort: return bin/name.exe so error shows expected location
-    return openmvs_bin / f"{name}.exe"
+    return bin_dir / f"{name}.exe"
 
 
 def run_openmvs_dense_pointcloud(
@@ -101,7 +157,8 @@ def run_openmvs_dense_pointcloud(
     """
     Stage 2 (CPU): Use OpenMVS to densify COLMAP SfM output.
 
-    Steps:
+    Steps (2 runs in-process instead when the OpenMVS Python module "MVS" is
+    importable and works):
       1) InterfaceCOLMAP -> scene.mvs
       2) DensifyPointCloud -> scene_dense.mvs (+ typically scene_dense.ply)
       3) Copy scene_dense.ply to desired output path
@@ -117,16 +174,16 @@ def run_openmvs_dense_pointcloud(
     dense_ply_out.parent.mkdir(parents=True, exist_ok=True)
 
     # Final sentinel skip
-    if resume and (not clean) and dense_ply_out.exists() and dense_ply_out.stat().st_size > 100_000:
-        print(f"[SKIP] OpenMVS dense point cloud exists: {dense_ply_out}")
+    if resume and (not clean) and size_or_neg(dense_ply_out) > 100_000:
+        logger.info("[SKIP] OpenMVS dense point cloud exists: %s", dense_ply_out)
         return dense_ply_out
 
     if clean and work_dir.exists():
         shutil.rmtree(work_dir)
     work_dir.mkdir(parents=True, exist_ok=True)
 
-    interface = _resolve_exe(openmvs_bin, "InterfaceCOLMAP")
-    densify = _resolve_exe(openmvs_bin, "DensifyPointCloud")
+    interface = _resolve_exe(str(openmvs_bin), "InterfaceCOLMAP")
+    densify = _resolve_exe(str(openmvs_bin), "DensifyPointCloud")
 
     scene_mvs = work_dir / "scene.mvs"
     scene_dense_mvs = work_dir / "scene_dense.mvs"
@@ -145,21 +202,22 @@ def run_openmvs_dense_pointcloud(
         ]
         _run(cmd, cwd=work_dir)
     else:
-        print("[SKIP] InterfaceCOLMAP (scene.mvs exists)")
+        logger.info("[SKIP] InterfaceCOLMAP (scene.mvs exists)")
 
     # 2) DensifyPointCloud
     # Many OpenMVS steps produce both .mvs and .ply; people commonly reference scene_dense.ply. :contentReference[oaicite:4]{index=4}
     if (not resume) or clean or (not scene_dense_mvs.exists()) or (not scene_dense_ply.exists()):
-        cmd = [
-            str(densify),
-            "-w", str(work_dir),
-            "-i", str(scene_mvs),
-            "-o", str(scene_dense_mvs),
-            "--resolution-level", str(int(resolution_level)),
-        ]
-        _run(cmd, cwd=work_dir)
+        if not _densify_in_process(scene_mvs, scene_dense_mvs, scene_dense_ply, resolution_level):
+            cmd = [
+                str(densify),
+                "-w", str(work_dir),
+                "-i", str(scene_mvs),
+                "-o", str(scene_dense_mvs),
+                "--resolution-level", str(int(resolution_level)),
+            ]
+            _run(cmd, cwd=work_dir)
     else:
-        print("[SKIP] DensifyPointCloud (scene_dense.* exists)")
+        logger.info("[SKIP] DensifyPointCloud (scene_dense.* exists)")
 
     if not scene_dense_ply.exists():
         raise RuntimeError(
@@ -167,6 +225,6 @@ def run_openmvs_dense_pointcloud(
             "Check OpenMVS stdout above for clues."
         )
 
-    shutil.copy2(scene_dense_ply, dense_ply_out)
-    print(f"[OK] OpenMVS dense point cloud: {dense_ply_out}")
+    publish_output(scene_dense_ply, dense_ply_out)
+    logger.info("[OK] OpenMVS dense point cloud: %s", dense_ply_out)
     return dense_ply_out
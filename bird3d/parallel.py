@@ -0,0 +1,178 @@
+import dataclasses
+import functools
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+
+# Set in pool workers by _init_worker and by Pipeline.run; None means "no limit".
+_gpu_sem = None
+
+
+def _init_worker(sem, log_queue=None, log_level=logging.INFO):
+    global _gpu_sem
+    _gpu_sem = sem
+    if log_queue is not None:
+        # Hand records to the parent's QueueListener, the only writer to the terminal.
+        log = logging.getLogger(__package__)
+        log.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+        log.setLevel(log_level)
+        log.propagate = False
+
+
+@contextmanager
+def gpu_slot():
+    """
+    Hold one GPU slot for the duration of a CUDA stage.
+    No-op outside of run_many workers and Pipeline.run.
+    """
+    if _gpu_sem is None:
+        yield
+        return
+    with _gpu_sem:
+        yield
+
+
+def threads_per_worker(max_workers: int) -> int:
+    """
+    Split the machine's cores across workers so COLMAP instances don't oversubscribe.
+    """
+    return max(1, (os.cpu_count() or 1) // max(1, max_workers))
+
+
+def run_many(folders, cfg, max_workers: int, *, worker, num_gpus: int = 1):
+    """
+    Run worker(folder, cfg_dict) for every folder, up to max_workers at a time.
+
+    cfg is passed as dataclasses.asdict(cfg) so workers only unpickle builtins.
+    Each worker gets num_threads = cpu_count // max_workers, and GPU stages
+    (guarded by gpu_slot()) are limited to num_gpus concurrent holders.
+    worker must be a module-level function so it can be pickled.
+    Results are returned in the order of folders. Workers log to the "bird3d"
+    logger through a queue; the parent writes their records with its handlers.
+    """
+    if max_workers > 1:
+        folders = list(folders)
+        max_workers = min(max_workers, len(folders))
+    if max_workers <= 1:
+        # Serial, and folders is consumed lazily (see prefetch)
+        cfg_dict = dataclasses.asdict(cfg)
+        return [worker(f, cfg_dict) for f in folders]
+
+    cfg_dict = dataclasses.asdict(dataclasses.replace(cfg, num_threads=threads_per_worker(max_workers)))
+    sem = multiprocessing.Semaphore(max(1, num_gpus))
+    log = logging.getLogger(__package__)
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_queue, *log.handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=(sem, log_queue, log.getEffectiveLevel()),
+        ) as executor:
+            return list(executor.map(functools.partial(worker, cfg_dict=cfg_dict), folders))
+    finally:
+        listener.stop()
+
+
+def prefetch(items, fn):
+    """
+    Yield fn(item) for every item, computing the next result on a background
+    thread while the caller works on the current one. The thread hands results
+    over through a Queue(maxsize=1) and starts the next item only once the caller
+    has taken the previous one, so it is exactly one item ahead.
+    An exception from fn is re-raised here.
+    """
+    q = queue.Queue(maxsize=1)
+    done = object()
+
+    def producer():
+        try:
+            for item in items:
+                q.put((fn(item), None))
+                q.join()  # wait until the caller took it
+        except BaseException as e:
+            q.put((None, e))
+        finally:
+            q.put((done, None))
+
+    threading.Thread(target=producer, name="prefetch", daemon=True).start()
+    while True:
+        result, error = q.get()
+        q.task_done()
+        if error is not None:
+            raise error
+        if result is done:
+            return
+        yield result
+
+
+class Pipeline:
+    """
+    Overlap the SfM of item N+1 with the dense stage of item N.
+
+    One thread runs sfm_fn(item) for every item and queues its (non-None) result;
+    a second thread runs dense_fn(result). The SfM thread pulls items itself, one
+    at a time, so a lazy iterator (see prefetch) is advanced only as SfM proceeds. GPU stages on either thread share
+    num_gpus slots through gpu_slot(). The first exception stops both threads and
+    is re-raised from run().
+    """
+
+    _DONE = object()
+
+    def __init__(self, sfm_fn, dense_fn, num_gpus: int = 1, prefetch: int = 1):
+        self.sfm_fn = sfm_fn
+        self.dense_fn = dense_fn
+        self.num_gpus = max(1, num_gpus)
+        self.dense_q = queue.Queue(maxsize=max(1, prefetch))
+        self.errors = []
+
+    def _sfm_worker(self, items):
+        try:
+            for item in items:
+                if self.errors:
+                    break
+                result = self.sfm_fn(item)
+                if result is not None:
+                    self.dense_q.put(result)
+        except BaseException as e:
+            self.errors.append(e)
+        finally:
+            self.dense_q.put(self._DONE)
+
+    def _dense_worker(self):
+        while True:
+            job = self.dense_q.get()
+            if job is self._DONE:
+                break
+            if self.errors:
+                continue  # keep draining so the SfM thread never blocks on put()
+            try:
+                self.dense_fn(job)
+            except BaseException as e:
+                self.errors.append(e)
+
+    def run(self, items):
+        global _gpu_sem
+        prev_sem = _gpu_sem
+        _gpu_sem = threading.BoundedSemaphore(self.num_gpus)
+        try:
+            threads = [
+                threading.Thread(target=self._sfm_worker, args=(items,), name="sfm_worker"),
+                threading.Thread(target=self._dense_worker, name="dense_worker"),
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            _gpu_sem = prev_sem
+
+        if self.errors:
+            raise self.errors[0]
@@ -0,0 +1,57 @@
+import collections
+import subprocess
+import sys
+from pathlib import Path
+from typing import Optional
+
+
+def _rotate(log_path: Path):
+    if log_path.exists():
+        log_path.replace(log_path.with_name(log_path.name + ".1"))
+
+
+def stream_cmd(cmd, *, log_path: Optional[Path] = None, cwd: Optional[Path] = None, tail_lines: int = 200):
+    """
+    Run cmd, echoing its combined stdout/stderr line by line to sys.stdout and
+    (optionally) to log_path. The previous log is kept as <log>.1.
+
+    Output is handled as raw bytes (no per-chunk locale decoding / newline
+    translation); only the tail is decoded. The pipe is drained continuously, so
+    the child never blocks on a full pipe buffer.
+
+    Returns (returncode, tail) where tail is the last tail_lines lines of output,
+    so memory stays bounded however chatty the command is.
+    """
+    tail = collections.deque(maxlen=tail_lines)
+    out = getattr(sys.stdout, "buffer", None)
+    log = None
+    if log_path is not None:
+        log_path = Path(log_path)
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        _rotate(log_path)
+        log = log_path.open("wb")
+
+    sys.stdout.flush()
+    try:
+        p = subprocess.Popen(
+            cmd,
+            cwd=str(cwd) if cwd else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        with p.stdout:
+            for line in p.stdout:
+                if out is not None:
+                    out.write(line)
+                    out.flush()
+                else:
+                    sys.stdout.write(line.decode("utf-8", "replace"))
+                if log is not None:
+                    log.write(line)
+                tail.append(line)
+        returncode = p.wait()
+    finally:
+        if log is not None:
+            log.close()
+
+    return returncode, b"".join(tail).decode("utf-8", "replace")
@@ -1,47 +1,366 @@
 #!/usr/bin/env python3
 import argparse
+import functools
+import logging
+import os
+import sys
 from pathlib import Path
 
 from bird3d.config import Config
-from bird3d.io_utils import list_bird_folders, list_images, ensure_clean_dir, copy_images
-from bird3d.colmap_sfm import run_sfm_sparse
+from bird3d.io_utils import (
+    list_images, load_or_build_manifest, ensure_clean_dir, copy_images, symlink_images,
+    can_use_inplace, staged_images_match, image_metadata,
+)
+from bird3d.colmap_sfm import ensure_vocab_tree, run_sfm_sparse
 from bird3d.metrics_sfm import export_model_to_txt, registered_images_best_effort
-from bird3d.colmap_dense import run_dense_fused_pointcloud
+from bird3d.colmap_dense import auto_pm_max_image_size, run_dense_fused_pointcloud
 from bird3d.openmvs_dense import run_openmvs_dense_pointcloud
 from bird3d.colmap_dense import ColmapCudaRequiredError
+from bird3d.cusfm_dense import CusfmUnavailableError, run_cusfm_dense
+from bird3d.parallel import Pipeline, gpu_slot, prefetch, run_many
+
+MIN_IMAGES = 15
+
+logger = logging.getLogger("bird3d")
+
+
+def _setup_logging():
+    # Same stream as the COLMAP/OpenMVS output, so messages stay in order with it.
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
 
 
 def parse_args():
     ap = argparse.ArgumentParser()
     ap.add_argument("--project", required=True, help="Path to Proj-3Dbird")
     ap.add_argument("--data_dir", default="data", help="Relative path under project (default: data)")
-    ap.add_argument("--matcher", choices=["sequential", "exhaustive"], default="sequential")
+    ap.add_argument("--matcher", choices=["sequential", "exhaustive", "vocab_tree"], default="sequential")
+    ap.add_argument("--vocab_tree_path", default=None,
+                    help="Vocab tree for --matcher vocab_tree (default: download once to the user cache).")
     ap.add_argument("--colmap_bin", default=None, help="Path to colmap executable if not on PATH")
+    ap.add_argument("--colmap_bin_cuda", default=None,
+                    help="Path to a CUDA-enabled colmap; enables GPU SIFT extraction/matching and COLMAP dense.")
+    ap.add_argument("--gpu_indices", default=None,
+                    help="GPU indices for SIFT, e.g. '0' or '0,1' (multi-GPU).")
     ap.add_argument("--clean", action="store_true", help="Delete _work/<bird> and recompute")
     ap.add_argument("--resume", action="store_true",
                 help="Skip birds that already have outputs in _outputs/<bird>/sparse_txt/")
     ap.add_argument("--stage", choices=["sfm", "dense", "all"], default="sfm",
                     help="What to run: sfm, dense, or all")
     ap.add_argument("--dense_max_image_size", type=int, default=None,
-                    help="Max image size for dense steps (undistort/patch-match/fusion). Lower = faster/less RAM.")
+                    help="Max image size for all dense steps (undistort/patch-match/fusion). Lower = faster/less RAM.")
+    ap.add_argument("--pm_max_image_size", type=int, default=None,
+                    help="Max image size for patch-match only (default 800); overrides --dense_max_image_size there.")
     ap.add_argument("--dense_geom_consistency", action="store_true",
                     help="Enable geometric consistency in patch-match stereo (slower, sometimes cleaner).")
     ap.add_argument("--dense_patchmatch_cache_gb", type=int, default=None,
-                    help="PatchMatchStereo.cache_size (GB)")
+                    help="PatchMatchStereo.cache_size (GB); default: half of available RAM, min 4")
     ap.add_argument("--dense_fusion_cache_gb", type=int, default=None,
-                    help="StereoFusion.cache_size (GB)")
-    ap.add_argument("--dense_backend", choices=["colmap", "openmvs"], default=None,
-                    help="Dense backend: 'colmap' (CUDA-only) or 'openmvs' (CPU capable).")
+                    help="StereoFusion.cache_size (GB); default: half of available RAM, min 4")
+    ap.add_argument("--dense_backend", choices=["colmap", "openmvs", "cusfm"], default=None,
+                    help="Dense backend: 'colmap' (CUDA-only), 'openmvs' (CPU capable) or "
+                         "'cusfm' (pyCuSFM GPU; falls back to colmap if pycusfm is missing).")
     ap.add_argument("--openmvs_bin", default=None,
                     help="Path to OpenMVS bin folder containing InterfaceCOLMAP.exe, DensifyPointCloud.exe, etc.")
     ap.add_argument("--openmvs_resolution_level", type=int, default=None,
                     help="OpenMVS DensifyPointCloud --resolution-level (2 or 3 recommended for speed/memory).")
+    ap.add_argument("--no_mapper_fast_preset", action="store_true",
+                    help="Use COLMAP's default (slower) global bundle-adjustment schedule in mapper.")
+    ap.add_argument("--ba_gpu", action="store_true",
+                    help="Run mapper bundle adjustment on the GPU (COLMAP built with CUDA-enabled Ceres).")
+    ap.add_argument("--hierarchical", action="store_true",
+                    help="Always use COLMAP hierarchical_mapper (default: only above 200 images).")
+    ap.add_argument("--sfm_single_process", action="store_true",
+                    help="Run extraction+matching+mapping in one COLMAP process (automatic_reconstructor).")
+    ap.add_argument("--link_mode", choices=["hardlink", "reflink", "copy"], default=None,
+                    help="How to stage images_clean: hardlink (default), reflink (CoW clone) or copy (in-kernel).")
+    ap.add_argument("--stage_mode", choices=["copy", "symlink", "inplace"], default=None,
+                    help="How images_clean is built: symlink (default), copy (see --link_mode), "
+                         "or inplace (use the bird folder directly when it holds only images).")
+    ap.add_argument("--limit", type=int, default=None,
+                    help="Only process the first N bird folders (default: all).")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Process birds in parallel with this many workers (each COLMAP gets cores/workers threads).")
+    ap.add_argument("--threads_per_bird", type=int, default=None,
+                    help="Size the process pool as cores // threads_per_bird (overrides --workers).")
+    ap.add_argument("--overlap", action="store_true",
+                    help="With --stage dense/all: run SfM of the next bird while the current bird runs dense.")
+    ap.add_argument("--prefetch", action="store_true",
+                    help="With --workers 1: stage the next bird's images_clean in the background.")
+    ap.add_argument("--num_gpus", type=int, default=None,
+                    help="Max concurrent CUDA stages across workers (default: 1).")
 
     return ap.parse_args()
 
 
+def _needs_export(bin_dir: Path, txt_dir: Path) -> bool:
+    """
+    True unless txt_dir/images.txt is at least as new as every file of the BIN model.
+    """
+    try:
+        txt_mtime = (txt_dir / "images.txt").stat().st_mtime
+    except FileNotFoundError:
+        return True
+    return any(p.stat().st_mtime > txt_mtime for p in bin_dir.iterdir() if p.is_file())
+
+
+def _prepare_work_dir(bird_work: Path, clean: bool):
+    if clean:
+        ensure_clean_dir(bird_work)
+    else:
+        bird_work.mkdir(parents=True, exist_ok=True)
+
+
+def stage_bird_images(bird_dir: Path, imgs, bird_work: Path, cfg: Config) -> Path:
+    """
+    Build images_clean for one bird (per cfg.stage_mode) and return the images dir
+    COLMAP should read.
+    """
+    clean_dir = bird_work / "images_clean"
+    if cfg.stage_mode == "inplace" and can_use_inplace(bird_dir, imgs):
+        clean_dir = bird_dir
+        logger.info("[INFO] Using images in place: %s", bird_dir)
+    elif staged_images_match(clean_dir, imgs):
+        logger.info("[SKIP] images_clean already prepared")
+    elif cfg.stage_mode == "copy":
+        copy_images(imgs, clean_dir, link_mode=cfg.link_mode)
+    else:
+        # "symlink", or "inplace" when the bird folder also holds other files
+        symlink_images(imgs, clean_dir, link_mode=cfg.link_mode)
+    return clean_dir
+
+
+def prefetch_bird(item, cfg: Config, *, args, work_root: Path):
+    """
+    --prefetch: prepare _work/<bird> and images_clean on a background thread while
+    the previous bird runs. Returns item with the staged dir filled in; if staging
+    fails, item is returned as is and run_bird_sfm stages (and reports) it itself.
+    """
+    bird_dir, image_names, _ = item
+    if len(image_names) < MIN_IMAGES:
+        return item
+    bird_work = work_root / bird_dir.name
+    try:
+        _prepare_work_dir(bird_work, clean=args.clean)
+        clean_dir = stage_bird_images(bird_dir, [bird_dir / n for n in image_names], bird_work, cfg)
+    except OSError as e:
+        logger.info("[INFO] Prefetch of %s failed (%s); staging it in the main loop", bird_dir.name, e)
+        return item
+    return bird_dir, image_names, clean_dir
+
+
+def run_bird_sfm(item, cfg: Config, *, args, work_root: Path, out_root: Path):
+    """
+    Stage 1 for one bird: images_clean -> SfM -> TXT export.
+    item is (bird_dir, image file names from the manifest, staged images dir or
+    None); the staged dir is set by prefetch_bird.
+    Returns the job for run_bird_dense, or None when there is no dense work.
+    """
+    bird_dir, image_names, staged_dir = item
+    bird = bird_dir.name
+    logger.info("\n==============================")
+    logger.info("Bird: %s", bird)
+    logger.info("==============================")
+
+    imgs = [bird_dir / n for n in image_names]
+    logger.info("Found %s images", len(imgs))
+    if len(imgs) < MIN_IMAGES:
+        logger.info("Skipping (too few images).")
+        return None
+
+    # Work dirs (already prepared when the bird was prefetched)
+    bird_work = work_root / bird
+    if staged_dir is None:
+        _prepare_work_dir(bird_work, clean=args.clean)
+
+    sparse_txt = out_root / bird / "sparse_txt"
+    images_txt = sparse_txt / "images.txt"
+    model0 = bird_work / "sparse" / "0"
+    if args.resume and (not args.clean) and images_txt.exists():
+        registered = registered_images_best_effort(
+            cfg.colmap_bin,
+            sparse_txt,
+            images_txt_fallback=images_txt,
+        )
+        logger.info("[SKIP] Existing result. [OK] Registered images: %s / %s", registered, len(imgs))
+        logger.info("TXT model: %s", sparse_txt)
+        if args.stage == "sfm":
+            return None
+    elif args.resume and (not args.clean) and model0.exists():
+        # Re-export TXT from existing binary model (fast)
+        if _needs_export(model0, sparse_txt):
+            export_model_to_txt(cfg.colmap_bin, model0, sparse_txt)
+        registered = registered_images_best_effort(
+            cfg.colmap_bin,
+            sparse_txt,
+            images_txt_fallback=images_txt,
+        )
+        logger.info("[SKIP] Re-exported TXT. [OK] Registered images: %s / %s", registered, len(imgs))
+        logger.info("TXT model: %s", sparse_txt)
+        if args.stage == "sfm":
+            return None
+
+    if staged_dir is not None:
+        clean_dir = staged_dir
+    else:
+        clean_dir = stage_bird_images(bird_dir, imgs, bird_work, cfg)
+
+    # Run SfM (sparse)
+    sparse_bin = run_sfm_sparse(
+        images_dir=clean_dir,
+        work_dir=bird_work,
+        colmap_bin=cfg.colmap_bin_cuda or cfg.colmap_bin,
+        use_gpu=cfg.use_gpu,
+        matcher=cfg.matcher,
+        camera_model=cfg.camera_model,
+        single_camera=cfg.single_camera,
+        num_threads=cfg.num_threads,
+        mapper_fast_preset=cfg.mapper_fast_preset,
+        gpu_index=cfg.gpu_indices,
+        vocab_tree_path=Path(cfg.vocab_tree_path) if cfg.vocab_tree_path else None,
+        single_process=cfg.sfm_single_process,
+        ba_use_gpu=cfg.ba_use_gpu,
+        hierarchical_threshold=cfg.hierarchical_threshold,
+    )
+
+    # Export to TXT for easy metric parsing (skipped when the TXT model is up to date)
+    if _needs_export(sparse_bin, sparse_txt):
+        export_model_to_txt(cfg.colmap_bin, sparse_bin, sparse_txt)
+    else:
+        logger.info("[SKIP] TXT export (up to date): %s", sparse_txt)
+
+    registered = registered_images_best_effort(
+        cfg.colmap_bin,
+        sparse_bin,  # analyze the BIN model we just produced
+        images_txt_fallback=(sparse_txt / "images.txt"),
+    )
+    logger.info("[OK] Registered images: %s / %s", registered, len(imgs))
+    logger.info("TXT model: %s", sparse_txt)
+
+    if args.stage not in ("dense", "all"):
+        return None
+    return {"bird": bird, "bird_work": bird_work, "clean_dir": clean_dir, "sparse_bin": sparse_bin}
+
+
+def _pm_max_image_size(cfg: Config, image_max_dim) -> int:
+    """
+    PatchMatch max_image_size for one bird. Call inside gpu_slot(), so the free GPU
+    memory is not read while another bird's CUDA stage holds it.
+    """
+    if not cfg.pm_max_image_size_auto:
+        return cfg.pm_max_image_size
+    size, free_mb = auto_pm_max_image_size(
+        image_max_dim, cfg.pm_num_src_images, cfg.pm_max_image_size, gpu_index=cfg.gpu_indices,
+    )
+    if free_mb is not None:
+        logger.info("[INFO] pm_max_image_size: %s (auto, %s MiB GPU memory free)", size, free_mb)
+    return size
+
+
+def run_bird_dense(job, cfg: Config, *, args, out_root: Path):
+    """
+    Stage 2 for one bird: dense point cloud from the job returned by run_bird_sfm.
+    """
+    bird = job["bird"]
+    bird_work = job["bird_work"]
+    clean_dir = job["clean_dir"]
+    sparse_bin = job["sparse_bin"]
+
+    dense_out_dir = out_root / bird / "dense"
+    fused_out = dense_out_dir / "fused.ply"
+
+    # Dense workspace lives in _work
+    dense_ws = bird_work / "dense" / "0"
+
+    backend = cfg.dense_backend
+    image_max_dim = None
+    if cfg.pm_max_image_size_auto and backend in ("colmap", "cusfm"):
+        meta = image_metadata(list_images(clean_dir), bird_work / "image_meta.json")
+        image_max_dim = max((max(m["width"], m["height"]) for m in meta.values()), default=None)
+    if backend == "cusfm":
+        try:
+            with gpu_slot():
+                pm_max_image_size = _pm_max_image_size(cfg, image_max_dim)
+                run_cusfm_dense(
+                    sparse_model_dir=sparse_bin,
+                    images_dir=clean_dir,
+                    work_dir=bird_work / "dense" / "cusfm",
+                    fused_out_ply=fused_out,
+                    max_image_size=pm_max_image_size,
+                    clean=args.clean,
+                    resume=args.resume,
+                )
+            return
+        except CusfmUnavailableError as e:
+            logger.info("[INFO] cuSfM dense backend unavailable (%s); using COLMAP", e)
+            backend = "colmap"
+
+    if backend == "colmap":
+        try:
+            with gpu_slot():
+                pm_max_image_size = _pm_max_image_size(cfg, image_max_dim)
+                run_dense_fused_pointcloud(
+                    colmap_bin=cfg.colmap_bin_cuda or cfg.colmap_bin,
+                    images_dir=clean_dir,
+                    sparse_model_dir=sparse_bin,
+                    dense_workspace_dir=dense_ws,
+                    fused_out_ply=fused_out,
+                    undistort_max_image_size=cfg.undistort_max_image_size,
+                    pm_max_image_size=pm_max_image_size,
+                    fusion_max_image_size=cfg.fusion_max_image_size,
+                    fusion_check_num_images=cfg.fusion_check_num_images,
+                    geom_consistency=cfg.dense_geom_consistency,
+                    patchmatch_cache_size_gb=cfg.dense_patchmatch_cache_size_gb,
+                    fusion_cache_size_gb=cfg.dense_fusion_cache_size_gb,
+                    num_threads=cfg.num_threads,
+                    pm_window_radius=cfg.pm_window_radius,
+                    pm_window_step=cfg.pm_window_step,
+                    pm_num_iterations=cfg.pm_num_iterations,
+                    pm_num_samples=cfg.pm_num_samples,
+                    pm_filter_min_ncc=cfg.pm_filter_min_ncc,
+                    pm_num_src_images=cfg.pm_num_src_images,
+                    clean=args.clean,
+                    resume=args.resume,
+                )
+        except ColmapCudaRequiredError as e:
+            logger.error(
+                "\n[ERROR] COLMAP dense backend cannot run here:\n%s\n\nUse OpenMVS instead:\n"
+                "  python main_build_3dbird.py --project . --stage dense --dense_backend openmvs --resume",
+                e,
+            )
+            raise
+    else:
+        # OpenMVS CPU backend
+        run_openmvs_dense_pointcloud(
+            openmvs_bin=Path(cfg.openmvs_bin),
+            colmap_model_dir=bird_work,
+            images_dir=clean_dir,
+            work_dir=dense_ws,
+            dense_ply_out=fused_out,
+            resolution_level=cfg.openmvs_resolution_level,
+            clean=args.clean,
+            resume=args.resume,
+        )
+
+
+def process_bird(item, cfg_dict: dict, args_dict: dict, *, work_root: Path, out_root: Path):
+    """
+    Run the full per-bird pipeline (images_clean -> SfM -> TXT export -> optional dense).
+    Module-level and dict-in so it can be dispatched to a process pool.
+    """
+    cfg = Config(**cfg_dict)
+    args = argparse.Namespace(**args_dict)
+    job = run_bird_sfm(item, cfg, args=args, work_root=work_root, out_root=out_root)
+    if job is not None:
+        run_bird_dense(job, cfg, args=args, out_root=out_root)
+
+
 def main():
     args = parse_args()
+    _setup_logging()
     project_dir = Path(args.project).resolve()
     data_dir = (project_dir / args.data_dir).resolve()
 
@@ -57,10 +376,33 @@ def main():
         cb = (project_dir / cb).resolve()
     cfg.colmap_bin = str(cb)
 
+    if args.colmap_bin_cuda:
+        cfb = Path(args.colmap_bin_cuda)
+        if not cfb.is_absolute():
+            cfb = (project_dir / cfb).resolve()
+        cfg.colmap_bin_cuda = str(cfb)
+    if cfg.colmap_bin_cuda:
+        cfg.use_gpu = True
+    if args.gpu_indices is not None:
+        cfg.gpu_indices = args.gpu_indices
+
     cfg.matcher = args.matcher
+    if args.vocab_tree_path is not None:
+        cfg.vocab_tree_path = str(Path(args.vocab_tree_path).resolve())
+    elif cfg.matcher == "vocab_tree" and cfg.vocab_tree_path is None:
+        # Download once here; workers only read cfg.vocab_tree_path
+        cfg.vocab_tree_path = str(ensure_vocab_tree())
+    if args.no_mapper_fast_preset:
+        cfg.mapper_fast_preset = False
 
     if args.dense_max_image_size is not None:
-        cfg.dense_max_image_size = args.dense_max_image_size
+        cfg.undistort_max_image_size = args.dense_max_image_size
+        cfg.pm_max_image_size = args.dense_max_image_size
+        cfg.fusion_max_image_size = args.dense_max_image_size
+    if args.pm_max_image_size is not None:
+        cfg.pm_max_image_size = args.pm_max_image_size
+    if args.dense_max_image_size is not None or args.pm_max_image_size is not None:
+        cfg.pm_max_image_size_auto = False
     if args.dense_geom_consistency:
         cfg.dense_geom_consistency = True
     if args.dense_patchmatch_cache_gb is not None:
@@ -75,136 +417,59 @@ def main():
     if args.openmvs_resolution_level is not None:
         cfg.openmvs_resolution_level = args.openmvs_resolution_level
 
+    if args.sfm_single_process:
+        cfg.sfm_single_process = True
+    if args.ba_gpu:
+        cfg.ba_use_gpu = True
+    if args.hierarchical:
+        cfg.hierarchical_threshold = 0
+    if args.link_mode is not None:
+        cfg.link_mode = args.link_mode
+    if args.stage_mode is not None:
+        cfg.stage_mode = args.stage_mode
+    if args.num_gpus is not None:
+        cfg.num_gpus = args.num_gpus
+
     work_root = project_dir / "_work"
     out_root = project_dir / "_outputs"
     work_root.mkdir(exist_ok=True)
     out_root.mkdir(exist_ok=True)
 
-    bird_dirs = list_bird_folders(data_dir)
-    if not bird_dirs:
+    manifest_path = work_root / "manifest.json"
+    if args.clean and manifest_path.exists():
+        manifest_path.unlink()
+    manifest = load_or_build_manifest(data_dir, manifest_path)
+    if not manifest:
         raise RuntimeError(f"No bird folders under: {data_dir}")
+    birds = [(data_dir / name, images, None) for name, images in manifest.items()]
+    if args.limit is not None:
+        birds = birds[:args.limit]
 
-    for bird_dir in bird_dirs[0:1]:
-        bird = bird_dir.name
-        print("\n==============================")
-        print(f"Bird: {bird}")
-        print("==============================")
-
-        imgs = list_images(bird_dir)
-        print(f"Found {len(imgs)} images")
-        if len(imgs) < 15:
-            print("Skipping (too few images).")
-            continue
-
-        # Work dirs
-        bird_work = work_root / bird
-        if args.clean:
-            ensure_clean_dir(bird_work)
-        else:
-            bird_work.mkdir(parents=True, exist_ok=True)
-
-        sparse_txt = out_root / bird / "sparse_txt"
-        images_txt = sparse_txt / "images.txt"
-        model0 = bird_work / "sparse" / "0"
-        if args.resume and (not args.clean) and images_txt.exists():
-            registered = registered_images_best_effort(
-                cfg.colmap_bin,
-                sparse_txt,
-                images_txt_fallback=images_txt,
-            )
-            print(f"[SKIP] Existing result. [OK] Registered images: {registered} / {len(imgs)}")
-            print(f"TXT model: {sparse_txt}")
-            if args.stage == "sfm":
-                continue
-        elif args.resume and (not args.clean) and model0.exists():
-            # Re-export TXT from existing binary model (fast)
-            export_model_to_txt(cfg.colmap_bin, model0, sparse_txt)
-            registered = registered_images_best_effort(
-                cfg.colmap_bin,
-                sparse_txt,
-                images_txt_fallback=images_txt,
-            )
-            print(f"[SKIP] Re-exported TXT. [OK] Registered images: {registered} / {len(imgs)}")
-            print(f"TXT model: {sparse_txt}")
-            if args.stage == "sfm":
-                continue        
-
-        clean_dir = bird_work / "images_clean"
-        exts = {".jpg", ".jpeg", ".png"}
-        existing_imgs = []
-        if clean_dir.exists():
-            existing_imgs = [p for p in clean_dir.iterdir()
-                            if p.is_file() and p.suffix.lower() in exts]
-        if (not clean_dir.exists()) or (len(existing_imgs) != len(imgs)):
-            copy_images(imgs, clean_dir)
-        else:
-            print("[SKIP] images_clean already prepared")
-
-        # Run SfM (sparse)
-        sparse_bin = run_sfm_sparse(
-            images_dir=clean_dir,
-            work_dir=bird_work,
-            colmap_bin=cfg.colmap_bin,
-            use_gpu=cfg.use_gpu,
-            matcher=cfg.matcher,
-            camera_model=cfg.camera_model,
-            single_camera=cfg.single_camera,
-        )
-
-        # Stage 2: Dense point cloud
-        if args.stage in ("dense", "all"):
-            dense_out_dir = out_root / bird / "dense"
-            fused_out = dense_out_dir / "fused.ply"
-
-            # Dense workspace lives in _work
-            dense_ws = bird_work / "dense" / "0"
-
-            if cfg.dense_backend == "colmap":
-                try:
-                    run_dense_fused_pointcloud(
-                        colmap_bin=cfg.colmap_bin,
-                        images_dir=clean_dir,
-                        sparse_model_dir=sparse_bin,
-                        dense_workspace_dir=dense_ws,
-                        fused_out_ply=fused_out,
-                        max_image_size=cfg.dense_max_image_size,
-                        geom_consistency=cfg.dense_geom_consistency,
-                        patchmatch_cache_size_gb=cfg.dense_patchmatch_cache_size_gb,
-                        fusion_cache_size_gb=cfg.dense_fusion_cache_size_gb,
-                        clean=args.clean,
-                        resume=args.resume,
-                    )
-                except ColmapCudaRequiredError as e:
-                    print("\n[ERROR] COLMAP dense backend cannot run here:")
-                    print(e)
-                    print("\nUse OpenMVS instead:")
-                    print("  python main_build_3dbird.py --project . --stage dense --dense_backend openmvs --resume")
-                    raise
-            else:
-                # OpenMVS CPU backend
-                run_openmvs_dense_pointcloud(
-                    openmvs_bin=Path(cfg.openmvs_bin),
-                    colmap_model_dir=bird_work,
-                    images_dir=clean_dir,
-                    work_dir=dense_ws,
-                    dense_ply_out=fused_out,
-                    resolution_level=cfg.openmvs_resolution_level,
-                    clean=args.clean,
-                    resume=args.resume,
-                )
+    workers = args.workers
+    if args.threads_per_bird:
+        workers = max(1, min(len(birds), (os.cpu_count() or 1) // args.threads_per_bird))
 
-        # Export to TXT for easy metric parsing
-        export_model_to_txt(cfg.colmap_bin, sparse_bin, sparse_txt)
+    items = birds
+    if args.prefetch and workers <= 1:
+        items = prefetch(items, functools.partial(prefetch_bird, cfg=cfg, args=args, work_root=work_root))
 
-        registered = registered_images_best_effort(
-            cfg.colmap_bin,
-            sparse_bin,  # analyze the BIN model we just produced
-            images_txt_fallback=(sparse_txt / "images.txt"),
+    if args.overlap and workers <= 1 and args.stage in ("dense", "all"):
+        Pipeline(
+            functools.partial(run_bird_sfm, cfg=cfg, args=args, work_root=work_root, out_root=out_root),
+            functools.partial(run_bird_dense, cfg=cfg, args=args, out_root=out_root),
+            num_gpus=cfg.num_gpus,
+        ).run(items)
+    else:
+        # workers=1 runs serially in this process
+        run_many(
+            items,
+            cfg,
+            workers,
+            worker=functools.partial(process_bird, args_dict=vars(args), work_root=work_root, out_root=out_root),
+            num_gpus=cfg.num_gpus,
         )
-        print(f"[OK] Registered images: {registered} / {len(imgs)}")
-        print(f"TXT model: {sparse_txt}")
 
-    print("\nDone.")
+    logger.info("\nDone.")
 
 
 if __name__ == "__main__":
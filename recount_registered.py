@@ -1,19 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from bird3d.metrics_sfm import count_registered_images
 
 
+def _count(images_txt: Path):
+    if not images_txt.exists():
+        return None
+    return count_registered_images(images_txt)
+
+
 def main():
     out_root = Path("_outputs")
     if not out_root.exists():
         raise FileNotFoundError("_outputs not found. Run from project root.")
 
-    for bird_dir in sorted([p for p in out_root.iterdir() if p.is_dir()]):
-        images_txt = bird_dir / "sparse_txt" / "images.txt"
-        if not images_txt.exists():
-            print(f"[SKIP] {bird_dir.name}: no sparse_txt/images.txt")
-            continue
-        n = count_registered_images(images_txt)
-        print(f"{bird_dir.name}: Registered images = {n}")
+    dirs = sorted([p for p in out_root.iterdir() if p.is_dir()])
+    # Each count is independent file I/O; ex.map keeps the output in folder order.
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        counts = ex.map(_count, (d / "sparse_txt" / "images.txt" for d in dirs))
+        for bird_dir, n in zip(dirs, counts):
+            if n is None:
+                print(f"[SKIP] {bird_dir.name}: no sparse_txt/images.txt")
+                continue
+            print(f"{bird_dir.name}: Registered images = {n}")
 
 
 if __name__ == "__main__":